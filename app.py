@@ -1,59 +1,226 @@
-import json
+import time
+from datetime import datetime
 
+import orjson
 import pymongo
-from bson.json_util import dumps
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from flask import Flask, jsonify, request, url_for, make_response
-
-
-client = pymongo.MongoClient('localhost', 27017)
+from flask import Flask, request, url_for
+
+
+client = pymongo.MongoClient(
+    'localhost',
+    27017,
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=2000,
+    connectTimeoutMS=2000,
+    socketTimeoutMS=5000,
+    retryWrites=True,
+)
 db = client["songs_db"]
 
 app = Flask(__name__)
 
 
+def _ensure_indexes():
+    '''
+    Create the indexes used by the endpoints once at startup,
+    so request handlers never pay the create_index round-trip.
+    '''
+    db.songs.create_index(
+        [("title", "text"), ("artist", "text")],
+        name="songs_search",
+        background=True
+    )
+    db.songs.create_index(
+        [("level", 1), ("difficulty", 1)],
+        name="level_diff_cov",
+        background=True
+    )
+
+
+def _backfill_rating_stats():
+    '''
+    Idempotent migration: derive the rating rollup fields from existing
+    ratings arrays, so documents rated before the rollup fields existed
+    can be served by the aggregation-free read path.
+    '''
+    db.songs.update_many(
+        {"rating_count": {"$exists": False}, "ratings": {"$exists": True}},
+        [{"$set": {
+            "rating_count": {"$size": "$ratings"},
+            "rating_sum": {"$sum": "$ratings"},
+            "rating_min": {"$min": "$ratings"},
+            "rating_max": {"$max": "$ratings"},
+        }}],
+    )
+
+
+try:
+    client.admin.command('ping')
+    _ensure_indexes()
+    _backfill_rating_stats()
+except pymongo.errors.PyMongoError as error:
+    app.logger.warning('Database warmup skipped: %s', error)
+
+
+def _json_default(obj):
+    '''Encode the BSON types orjson doesn't handle natively.'''
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj)} is not JSON serializable')
+
+
+def fast_json_response(obj, status=200):
+    '''
+    Serialize an object containing BSON types straight into a JSON
+    response with orjson, skipping the jsonify machinery entirely.
+    '''
+    return app.response_class(
+        orjson.dumps(obj, default=_json_default, option=orjson.OPT_SORT_KEYS),
+        status=status,
+        mimetype='application/json',
+    )
+
+
+_SONG_FIELDS = {
+    "_id": 1,
+    "artist": 1,
+    "difficulty": 1,
+    "level": 1,
+    "released": 1,
+    "title": 1,
+}
+
+_MAX_PAGE_LIMIT = 100
+_MAX_SEARCH_LIMIT = 200
+
+_count_cache = {"value": None, "time": 0}
+_COUNT_TTL = 30
+
+# Both aggregation endpoints are read far more often than their inputs
+# change, so bursts of identical requests collapse into one database
+# call. The rating cache is invalidated on every new rating.
+_avg_cache = TTLCache(maxsize=128, ttl=10)
+_rating_cache = TTLCache(maxsize=1024, ttl=60)
+
+
+def _cached_songs_count():
+    '''
+    Return the cached songs count, or None once the TTL has expired.
+    '''
+    if _count_cache["value"] is None:
+        return None
+    if time.time() - _count_cache["time"] > _COUNT_TTL:
+        return None
+    return _count_cache["value"]
+
+
+def _store_songs_count(value):
+    _count_cache["value"] = value
+    _count_cache["time"] = time.time()
+
+
+def _songs_count():
+    '''
+    Return the size of the songs collection, cached for a short TTL.
+    Reads the O(1) collection metadata estimate instead of running
+    a full count on every request.
+    '''
+    count = _cached_songs_count()
+    if count is None:
+        count = db.songs.estimated_document_count()
+        _store_songs_count(count)
+    return count
+
+
 @app.route('/songs', methods=['GET'])
 def get_songs_list():
     '''
     GET a list of songs.
-    The results are paginated using the 'page' and 'limit' parameters.
+    The results are paginated using the 'after' cursor and 'limit'
+    parameters. The 'page' parameter is kept for legacy clients and
+    falls back to skip/limit pagination.
     '''
     try:
         limit = int(request.args.get('limit', 5))
         page = int(request.args.get("page", 1))
     except ValueError:
         error_msg = 'limit and page parameter must be an integer'
-        return make_response(jsonify({'error': error_msg}), 400)
-
-    song_list = db.songs.find().sort("_id").skip(limit * (page - 1)).limit(limit)
-    songs_count = db.songs.count_documents({})
-
-    links = {
-        "current_page": {"href": url_for(".get_songs_list", page=page, _external=True)},
-        "last_page": {
-            "href": url_for(
-                ".get_songs_list", page=(songs_count // limit) + 1, _external=True
-            )
-        },
-    }
-
-    if page > 1:
-        links["prev_page"] = {
-            "href": url_for(".get_songs_list", page=page - 1, _external=True)
+        return fast_json_response({'error': error_msg}, 400)
+
+    if limit <= 0 or page <= 0:
+        error_msg = 'limit and page parameter must be a positive integer'
+        return fast_json_response({'error': error_msg}, 400)
+
+    limit = min(limit, _MAX_PAGE_LIMIT)
+
+    after = request.args.get('after')
+
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            return fast_json_response({'error': 'Invalid after cursor.'}, 400)
+        cursor = db.songs.find({"_id": {"$gt": ObjectId(after)}}, _SONG_FIELDS)
+        song_list = list(cursor.sort("_id").limit(limit))
+    elif (songs_count := _cached_songs_count()) is not None:
+        cursor = db.songs.find({}, _SONG_FIELDS)
+        song_list = list(cursor.sort("_id").skip(limit * (page - 1)).limit(limit))
+    else:
+        # One $facet round-trip fetches the page and refreshes the
+        # count cache together.
+        pipeline = [{"$facet": {
+            "songs": [
+                {"$sort": {"_id": 1}},
+                {"$skip": limit * (page - 1)},
+                {"$limit": limit},
+                {"$project": _SONG_FIELDS},
+            ],
+            "total": [{"$count": "n"}],
+        }}]
+        facets = next(db.songs.aggregate(pipeline))
+        song_list = facets["songs"]
+        songs_count = facets["total"][0]["n"] if facets["total"] else 0
+        _store_songs_count(songs_count)
+
+    # One URL-map lookup per request; the links only differ in their
+    # query strings.
+    base_url = url_for(".get_songs_list", _external=True)
+
+    if after is not None:
+        # Cursor mode has no meaningful page numbers, so only cursor
+        # links are emitted.
+        links = {
+            "current_page": {"href": f"{base_url}?after={after}"},
+        }
+        has_next = len(song_list) == limit
+    else:
+        links = {
+            "current_page": {"href": f"{base_url}?page={page}"},
+            "last_page": {
+                "href": f"{base_url}?page={songs_count // limit + 1}"
+            },
         }
+        if page > 1:
+            links["prev_page"] = {"href": f"{base_url}?page={page - 1}"}
+        has_next = page - 1 < songs_count // limit
 
-    if page - 1 < songs_count // limit:
+    if has_next and song_list:
         links["next_page"] = {
-            "href": url_for(".get_songs_list", page=page + 1, _external=True)
+            "href": f"{base_url}?after={song_list[-1]['_id']}"
         }
 
     result = {
-        'songs': [{item: song[item] for item in song} for song in song_list],
+        'songs': song_list,
         'links': links,
     }
 
-    result = json.loads(dumps(result))
-    return jsonify(result)
+    return fast_json_response(result)
 
 
 @app.route('/songs/difficulty/avg', methods=['GET'])
@@ -67,11 +234,15 @@ def get_avg_difficulty():
 
     if level is not None:
         try:
-            query += [{"$match": {"level": int(level)}}]
+            level = int(level)
         except ValueError:
-            return make_response(
-                jsonify({"error": 'level parameter must be an integer'}), 400
+            return fast_json_response(
+                {"error": 'level parameter must be an integer'}, 400
             )
+        query += [{"$match": {"level": level}}]
+
+    if level in _avg_cache:
+        return fast_json_response(_avg_cache[level])
 
     query += [{
                 '$group': {
@@ -89,11 +260,10 @@ def get_avg_difficulty():
     result = dict(*db.songs.aggregate(query))
 
     if not result:
-        return make_response(
-            jsonify({"error": "No songs with choosen level"}), 404
-        )
+        return fast_json_response({"error": "No songs with choosen level"}, 404)
 
-    return make_response(jsonify(result), 200)
+    _avg_cache[level] = result
+    return fast_json_response(result)
 
 
 @app.route('/songs/search', methods=['GET'])
@@ -103,23 +273,33 @@ def search_songs():
     '''
     message = request.args.get('message')
     if message is None:
-        return make_response(
-            jsonify({"error": "'message' parameter is required"}), 400
+        return fast_json_response(
+            {"error": "'message' parameter is required"}, 400
         )
 
-    db.songs.create_index(
-        [("title", "text"), ("artist", "text")],
-        name="songs_search"
-    )
-    result = db.songs.find({"$text": {"$search": message}})
-    result = json.loads(dumps(result))
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return fast_json_response(
+            {'error': 'limit parameter must be an integer'}, 400
+        )
 
-    if not result:
-        return make_response(
-            jsonify({"error": "Not found any song."}), 404
+    if limit <= 0:
+        return fast_json_response(
+            {'error': 'limit parameter must be a positive integer'}, 400
         )
 
-    return make_response(jsonify(result), 200)
+    limit = min(limit, _MAX_SEARCH_LIMIT)
+
+    projection = dict(_SONG_FIELDS, score={"$meta": "textScore"})
+    cursor = db.songs.find({"$text": {"$search": message}}, projection)
+    cursor = cursor.sort([("score", {"$meta": "textScore"})]).limit(limit)
+    result = list(cursor)
+
+    if not result:
+        return fast_json_response({"error": "Not found any song."}, 404)
+
+    return fast_json_response(result)
 
 
 @app.route('/songs/rating', methods=['POST'])
@@ -132,33 +312,46 @@ def add_rating():
 
     if song_id is None or rating is None:
         error_msg = "'song_id' and 'rating' parameter is required."
-        return make_response(jsonify({"error": error_msg}), 400)
+        return fast_json_response({"error": error_msg}, 400)
 
-    rating = float(rating)
+    try:
+        rating = float(rating)
+    except ValueError:
+        error_msg = "'rating' parameter must be a number"
+        return fast_json_response({"error": error_msg}, 400)
 
-    if (float(rating) < 1 or float(rating) > 5):
+    if not 1 <= rating <= 5:
         error_msg = "'rating' parameter must be between 1-5"
-        return make_response(jsonify({"error": error_msg}), 400)
+        return fast_json_response({"error": error_msg}, 400)
 
-    if not ObjectId.is_valid(song_id):
+    try:
+        oid = ObjectId(song_id)
+    except (InvalidId, TypeError):
         error_msg = 'Invalid song id.'
-        return make_response(jsonify({'error': error_msg}), 400)
+        return fast_json_response({'error': error_msg}, 400)
+
+    result = db.songs.find_one_and_update(
+        {'_id': oid},
+        {
+            '$push': {'ratings': rating},
+            '$inc': {'rating_count': 1, 'rating_sum': rating},
+            '$min': {'rating_min': rating},
+            '$max': {'rating_max': rating},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
 
-    if not db.songs.find_one({'_id': ObjectId(song_id)}):
+    if result is None:
         error_msg = "Song not found."
-        return make_response(jsonify({"error": error_msg}), 404)
+        return fast_json_response({"error": error_msg}, 404)
 
-    db.songs.update_one(
-        {'_id': ObjectId(song_id)},
-        {'$push': {'ratings': rating}}
-    )
+    _rating_cache.pop(song_id, None)
 
-    result = db.songs.find_one({'_id': ObjectId(song_id)})
     response = {
         "msg": "Ratings for the song updated",
-        'song': json.loads(dumps(result))
+        'song': result
     }
-    return make_response(jsonify(response), 201)
+    return fast_json_response(response, 201)
 
 
 @app.route('/songs/rating/<string:song_id>', methods=['GET'])
@@ -166,38 +359,31 @@ def get_song_rating(song_id: str):
     '''
     GET an average, lowest and highest rating of the given song by id.
     '''
-    if not ObjectId.is_valid(song_id):
-        return make_response(jsonify({'error': 'Invalid song id'}), 400)
-
-    song = db.songs.find_one({'_id': ObjectId(song_id)})
+    try:
+        oid = ObjectId(song_id)
+    except (InvalidId, TypeError):
+        return fast_json_response({'error': 'Invalid song id'}, 400)
+
+    cached = _rating_cache.get(song_id)
+    if cached is not None:
+        return fast_json_response(cached)
+
+    song = db.songs.find_one(
+        {'_id': oid},
+        {'rating_count': 1, 'rating_sum': 1,
+         'rating_min': 1, 'rating_max': 1},
+    )
 
-    if not song:
-        return make_response(jsonify({'error': 'Song not found'}), 404)
-    if not song.get('ratings'):
-        return make_response(
-            jsonify({'error': "Song don't have rating yet."}), 404
+    if song is None or not song.get('rating_count'):
+        return fast_json_response(
+            {'error': "Song not found or don't have rating yet."}, 404
         )
 
-    query = [
-        {'$unwind': "$ratings"},
-        {
-            '$group': {
-                '_id': ObjectId(song_id),
-                'avg_rating': {'$avg': '$ratings'},
-                'min_rating': {'$min': '$ratings'},
-                'max_rating': {'$max': '$ratings'}
-            }
-        },
-        {
-            '$project': {
-                '_id': '$id',
-                'average_rating': {'$round': ['$avg_rating', 2]},
-                'min_rating': '$min_rating',
-                'max_rating': '$max_rating'
-            }
-        },
-    ]
-    result = dict(*db.songs.aggregate(query))
-    response = json.loads(dumps(result))
+    result = {
+        'average_rating': round(song['rating_sum'] / song['rating_count'], 2),
+        'min_rating': song['rating_min'],
+        'max_rating': song['rating_max'],
+    }
 
-    return jsonify(response)
+    _rating_cache[song_id] = result
+    return fast_json_response(result)
@@ -0,0 +1,10 @@
+from multiprocessing import cpu_count
+
+# Cooperative workers: gunicorn's gevent worker monkey-patches the
+# stdlib sockets before the app is imported, so pymongo's blocking
+# network calls yield to other greenlets and each worker can serve
+# many in-flight requests at once.
+worker_class = 'gevent'
+workers = cpu_count() * 2 + 1
+worker_connections = 1000
+bind = '127.0.0.1:5000'
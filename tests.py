@@ -3,7 +3,7 @@ from typing import Optional
 import unittest
 from werkzeug.wrappers import Response
 from bson.objectid import ObjectId
-from app import db, app
+from app import db, app, _backfill_rating_stats
 
 
 class TestBase(unittest.TestCase):
@@ -26,29 +26,29 @@ class TestBase(unittest.TestCase):
     @classmethod
     def setUpClass(cls) -> None:
         cls.add_test_song()
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
 
     @classmethod
     def tearDownClass(cls) -> None:
         db.songs.delete_one({'_id': ObjectId(cls.test_song_id)})
 
-    def setUp(self) -> None:
-        app.config['TESTING'] = True
-        self.client = app.test_client()
-
 
 class TestSongFetch(TestBase):
     """Testing fetching songs."""
 
     endpoint = "/songs"
     limit = 5
+    limit_cap = 100
 
     def fetch_songs_by_parameters(self,
                                   limit: Optional[int] = None,
-                                  page: Optional[int] = None) -> Response:
+                                  page: Optional[int] = None,
+                                  after: Optional[str] = None) -> Response:
 
         return self.client.get(
             self.endpoint,
-            query_string={'page': page, 'limit': limit}
+            query_string={'page': page, 'limit': limit, 'after': after}
         )
 
     def test_fetching_songs(self):
@@ -100,6 +100,43 @@ class TestSongFetch(TestBase):
         error_msg = 'The same content on different pages.'
         self.assertNotEqual(songs_list_1, songs_list_2, error_msg)
 
+    def test_keyset_pagination(self):
+        """Testing cursor pagination with the 'after' parameter."""
+
+        first_page = self.fetch_songs_by_parameters(limit=2)
+        cursor = json.loads(first_page.data)['songs'][-1]['_id']
+
+        response = self.fetch_songs_by_parameters(limit=2, after=cursor)
+        songs = json.loads(response.data)['songs']
+
+        error_msg = 'Fetching songs by cursor failed.'
+        self.assertEqual(response.status_code, 200, error_msg)
+
+        error_msg = 'Cursor page contains documents before the cursor.'
+        for song in songs:
+            self.assertGreater(song['_id'], cursor, error_msg)
+
+    def test_next_page_cursor_link(self):
+        """Testing that next_page carries the last document's id."""
+
+        response = self.fetch_songs_by_parameters(limit=1)
+        data = json.loads(response.data)
+        last_id = data['songs'][-1]['_id']
+
+        error_msg = 'next_page link missing the cursor.'
+        self.assertIn(
+            f'after={last_id}',
+            data['links']['next_page']['href'],
+            error_msg
+        )
+
+    def test_invalid_after_cursor_handling(self):
+        """Testing invalid 'after' cursor handling."""
+
+        response = self.fetch_songs_by_parameters(after='not_an_object_id')
+        error_msg = 'Handling invalid "after" cursor failed.'
+        self.assertEqual(response.status_code, 400, error_msg)
+
     def test_test_value_error_handling(self):
         """Testing ValueError handling."""
 
@@ -110,6 +147,24 @@ class TestSongFetch(TestBase):
         error_msg = 'ValueError handling incorrect'
         self.assertEqual(response.status_code, 400, error_msg)
 
+    def test_non_positive_parameters_handling(self):
+        """Testing non-positive limit and page handling."""
+
+        for params in ({'limit': 0}, {'limit': -5}, {'page': 0}, {'page': -1}):
+            response = self.fetch_songs_by_parameters(**params)
+            error_msg = 'Handling non-positive parameters failed.'
+            self.assertEqual(response.status_code, 400, error_msg)
+
+    def test_limit_cap(self):
+        """Testing the hard cap on the page limit."""
+
+        response = self.fetch_songs_by_parameters(limit=100000)
+        data_length = len(json.loads(response.data)['songs'])
+
+        error_msg = 'Capping the page limit failed.'
+        self.assertEqual(response.status_code, 200, error_msg)
+        self.assertLessEqual(data_length, self.limit_cap, error_msg)
+
 
 class TestSongDifficulty(TestBase):
     """Testing a fetching of songs average difficulty."""
@@ -158,11 +213,14 @@ class TestSearchSong(TestBase):
     """Testing a searching songs by message."""
 
     endpoint = "/songs/search"
+    limit_cap = 200
 
-    def search_song(self, message: str) -> Response:
+    def search_song(self,
+                    message: str,
+                    limit: Optional[int] = None) -> Response:
         return self.client.get(
             self.endpoint,
-            query_string={'message': message}
+            query_string={'message': message, 'limit': limit}
         )
 
     def test_successufull_search_songs(self):
@@ -193,6 +251,40 @@ class TestSearchSong(TestBase):
         error_msg = 'ValueError handling failed.'
         self.assertEqual(response.status_code, 400, error_msg)
 
+    def test_non_positive_limit_handling(self):
+        """Testing non-positive limit handling."""
+
+        for limit in (0, -5):
+            response = self.search_song(message='The Yousicians', limit=limit)
+            error_msg = 'Handling non-positive "limit" failed.'
+            self.assertEqual(response.status_code, 400, error_msg)
+
+    def test_limit_value_error_handling(self):
+        """Testing ValueError handling for the limit parameter."""
+
+        response = self.search_song(message='The Yousicians',
+                                    limit='some_string')
+        error_msg = 'Handling non-integer "limit" failed.'
+        self.assertEqual(response.status_code, 400, error_msg)
+
+    def test_limit_cap(self):
+        """Testing the hard cap on the number of search results."""
+
+        token = 'Limitcaptoken'
+        db.songs.insert_many(
+            [{'artist': token, 'title': f'song {i}'}
+             for i in range(self.limit_cap + 1)]
+        )
+        try:
+            response = self.search_song(message=token, limit=100000)
+            data_length = len(json.loads(response.data))
+
+            error_msg = 'Capping the search limit failed.'
+            self.assertEqual(response.status_code, 200, error_msg)
+            self.assertEqual(data_length, self.limit_cap, error_msg)
+        finally:
+            db.songs.delete_many({'artist': token})
+
 
 class TestPostSongRating(TestBase):
     """Testing POST song rating by song id."""
@@ -232,6 +324,14 @@ class TestPostSongRating(TestBase):
         error_msg = 'Handling incorrect "rating" failed.'
         self.assertEqual(response.status_code, 400, error_msg)
 
+    def test_handling_non_numeric_rating(self):
+        """Handling non-numeric rating value."""
+
+        response = self.add_rating(rating='some_string',
+                                   song_id=self.test_song_id)
+        error_msg = 'Handling non-numeric "rating" failed.'
+        self.assertEqual(response.status_code, 400, error_msg)
+
     def test_handling_incorrect_song_id(self):
         """Handling incorrect song id value."""
 
@@ -279,6 +379,29 @@ class TestGetSongRating(TestBase):
         self.assertEqual(response.json['max_rating'], float(5.0), error_msg)
         self.assertEqual(response.json['min_rating'], float(1.0), error_msg)
 
+    def test_backfilled_rating_stats(self):
+        """Testing rating stats for a song rated before the rollup fields."""
+
+        legacy_song_id = "777e74484c3c579a594e04d1"
+        legacy_song = {
+            "_id": ObjectId(legacy_song_id),
+            "artist": "The Yousicians",
+            "title": "Legacy Ratings",
+            "ratings": [2, 4],
+        }
+        db.songs.insert_one(legacy_song)
+        try:
+            _backfill_rating_stats()
+            response = self.get_rating_by_song_id(song_id=legacy_song_id)
+
+            error_msg = 'Backfilled rating stats incorrect.'
+            self.assertEqual(response.status_code, 200, error_msg)
+            self.assertEqual(response.json['average_rating'], 3.0, error_msg)
+            self.assertEqual(response.json['min_rating'], 2, error_msg)
+            self.assertEqual(response.json['max_rating'], 4, error_msg)
+        finally:
+            db.songs.delete_one({'_id': ObjectId(legacy_song_id)})
+
     def test_handling_incorrect_song_id(self):
         """Handling incorrect song id value."""
 